@@ -1,16 +1,47 @@
+from __future__ import annotations
+
 import os
 import sys
-import json
+import io
+import atexit
+import importlib.util
+import mimetypes
+import tempfile
+import threading
+from itertools import islice
+from dataclasses import dataclass, field
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Callable, Iterator
 
 try:
-    from google import genai
-    from google.genai import types
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    _loads = json.loads
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import zstandard as zstd
 except ImportError:
-    print("Please install the google-genai package:")
-    print("  pip install -U google-genai")
-    sys.exit(1)
+    zstd = None
+
+if TYPE_CHECKING:
+    from google import genai
 
 APP_NAME = "Origami Thought Protocol"
 APP_SHORT = "OTP"
@@ -18,7 +49,13 @@ APP_VERSION = "1.0.0"
 
 DATA_DIR = Path.home() / ".otp"
 HISTORY_DIR = DATA_DIR / "history"
+INDEX_FILE = HISTORY_DIR / "index.jsonl"
 CONFIG_FILE = DATA_DIR / "config.json"
+REPL_HISTORY_FILE = DATA_DIR / "repl_history"
+
+DISPLAY_LIMIT = 200
+BACKGROUND_UPLOAD_MIN_SIZE = 2 * 1024 * 1024
+SESSION_ARCHIVE_AGE = timedelta(days=7)
 
 MODELS = [
    "gemini-3-pro-preview",
@@ -29,6 +66,18 @@ MODELS = [
     "gemini-2.0-flash-lite",
 ]
 
+MIME_TYPES = MappingProxyType({
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+    '.png': 'image/png', '.gif': 'image/gif', '.webp': 'image/webp',
+    '.mp4': 'video/mp4', '.mpeg': 'video/mpeg',
+    '.mov': 'video/quicktime', '.avi': 'video/x-msvideo', '.webm': 'video/webm',
+    '.mkv': 'video/x-matroska',
+    '.mp3': 'audio/mp3', '.wav': 'audio/wav',
+    '.aiff': 'audio/aiff', '.aac': 'audio/aac',
+    '.ogg': 'audio/ogg', '.flac': 'audio/flac',
+    '.m4a': 'audio/mp4', '.opus': 'audio/opus',
+})
+
 SYSTEM_PROMPT = """You are the KERNEL of the "Origami Thought Protocol", an advanced semantic compression engine.
 GOAL: Achieve MAXIMUM ENTROPY REDUCTION (lowest token count) while maintaining 100% LOGICAL and Mathematical RECOVERABILITY.
 
@@ -69,10 +118,72 @@ Example Output: \`@Map{U=User,S=Status,A=Active,R=Role}; U(John){S:A|R:Admin}\`"
 def ensure_directories():
     DATA_DIR.mkdir(exist_ok=True)
     HISTORY_DIR.mkdir(exist_ok=True)
+    if zstd is not None:
+        threading.Thread(target=ChatHistory.compact_old_sessions, daemon=True).start()
+
+
+def _atomic_write(path: Path, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
 
 
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt':
+        os.system('cls')
+        return
+    sys.stdout.write("\x1b[2J\x1b[H")
+    sys.stdout.flush()
+
+
+def setup_readline():
+    try:
+        import readline
+    except ImportError:
+        return
+    
+    try:
+        readline.read_history_file(REPL_HISTORY_FILE)
+    except OSError:
+        pass
+    readline.set_history_length(1000)
+    # Only chat prompts are recorded (see add_repl_history), not menu answers or file paths.
+    readline.set_auto_history(False)
+    atexit.register(readline.write_history_file, REPL_HISTORY_FILE)
+    
+    def complete_command(text: str, state: int) -> str | None:
+        if not readline.get_line_buffer().startswith('/'):
+            return None
+        matches = [cmd for cmd in COMMAND_HANDLERS if cmd.startswith(text)]
+        return matches[state] if state < len(matches) else None
+    
+    readline.set_completer_delims(" \t\n")
+    readline.set_completer(complete_command)
+    readline.parse_and_bind("tab: complete")
+
+
+def add_repl_history(line: str):
+    try:
+        import readline
+    except ImportError:
+        return
+    readline.add_history(line)
+
+
+def clear_repl_history():
+    try:
+        import readline
+        readline.clear_history()
+    except ImportError:
+        pass
+    REPL_HISTORY_FILE.unlink(missing_ok=True)
 
 
 def print_header(title: str):
@@ -80,16 +191,29 @@ def print_header(title: str):
     print("-" * 40)
 
 
+# Guards index.jsonl against the background session archiver. Reentrant
+# because appending may trigger a rebuild of a missing index.
+_INDEX_LOCK = threading.RLock()
+
+
 class ChatHistory:
+    _open_sessions: dict[Path, ChatHistory] = {}
+    
     def __init__(self):
+        now = datetime.now()
         self.messages: list[dict] = []
-        self.session_id: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.session_file: Path = HISTORY_DIR / f"chat_{self.session_id}.json"
+        self.session_id: str = now.strftime("%Y%m%d_%H%M%S")
+        self.session_file: Path = HISTORY_DIR / f"chat_{self.session_id}.jsonl"
+        self.meta_file: Path = self._meta_path(self.session_file)
         self.metadata: dict = {
-            "created": datetime.now().isoformat(),
+            "created": now.isoformat(),
             "model": None,
             "message_count": 0
         }
+        self._append_index(self._index_record())
+        self._fh = open(self.session_file, 'ab', buffering=1 << 16)
+        self._pending: list[bytes] = []
+        ChatHistory._open_sessions[self.session_file] = self
     
     def add_message(self, role: str, content: str, has_file: bool = False):
         message = {
@@ -100,48 +224,267 @@ class ChatHistory:
         }
         self.messages.append(message)
         self.metadata["message_count"] = len(self.messages)
-        self._save()
+        self._pending.append(_dumps(message) + b"\n")
     
-    def _save(self):
-        data = {
-            "metadata": self.metadata,
-            "messages": self.messages
-        }
-        
+    def flush(self):
+        # Messages are written once per turn, so a crash loses at most one turn.
+        if not self._pending:
+            return
+        try:
+            self._fh.write(b"".join(self._pending))
+            self._fh.flush()
+            self._pending.clear()
+        except Exception as e:
+            print(f"Warning: Could not save history: {e}")
+    
+    def _save(self, closed: bool = False):
         try:
-            with open(self.session_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            _atomic_write(self.meta_file, _dumps(self.metadata))
         except Exception as e:
             print(f"Warning: Could not save history: {e}")
+        self._append_index(self._index_record(closed))
+    
+    def _index_record(self, closed: bool = False) -> dict:
+        return {"id": self.session_id, "file": self.session_file.name, "closed": closed, **self.metadata}
     
     def set_model(self, model: str):
         self.metadata["model"] = model
         self._save()
     
     def get_session_path(self) -> Path:
+        self.flush()
         return self.session_file
     
+    def close(self):
+        if self._fh.closed:
+            return
+        self.flush()
+        self._fh.close()
+        ChatHistory._open_sessions.pop(self.session_file, None)
+        self._save(closed=True)
+    
+    @staticmethod
+    def _meta_path(session_path: Path) -> Path:
+        return session_path.with_name(f"chat_{ChatHistory._session_id(session_path)}.meta.json")
+    
+    @staticmethod
+    def _session_id(session_path: Path) -> str:
+        return session_path.name.split(".", 1)[0].removeprefix("chat_")
+    
+    @staticmethod
+    def _is_session_file(path: Path) -> bool:
+        return path.name.endswith((".jsonl", ".jsonl.zst", ".json")) and not path.name.endswith(".meta.json")
+    
+    @staticmethod
+    def _append_index(record: dict):
+        try:
+            ChatHistory._write_index_record(record)
+        except Exception as e:
+            print(f"Warning: Could not update history index: {e}")
+    
+    @staticmethod
+    def _write_index_record(record: dict):
+        with _INDEX_LOCK:
+            if not INDEX_FILE.exists():
+                ChatHistory._rebuild_index()
+            with open(INDEX_FILE, 'ab') as f:
+                f.write(_dumps(record) + b"\n")
+    
+    @staticmethod
+    def _rebuild_index() -> dict[str, dict]:
+        with _INDEX_LOCK:
+            entries = {}
+            for path in HISTORY_DIR.glob("chat_*.json*"):
+                if not ChatHistory._is_session_file(path):
+                    continue
+                session_id = ChatHistory._session_id(path)
+                entries[session_id] = {
+                    "id": session_id,
+                    "file": path.name,
+                    **(ChatHistory.load_metadata(path) or {})
+                }
+            
+            ChatHistory._write_index(entries)
+            return entries
+    
+    @staticmethod
+    def _write_index(entries: dict[str, dict]):
+        _atomic_write(INDEX_FILE, b"".join(_dumps(entry) + b"\n" for entry in entries.values()))
+    
     @staticmethod
-    def list_sessions() -> list[Path]:
+    def _read_index() -> dict[str, dict]:
+        with _INDEX_LOCK:
+            if not INDEX_FILE.exists():
+                return ChatHistory._rebuild_index()
+            
+            entries = {}
+            records = 0
+            with open(INDEX_FILE, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    records += 1
+                    try:
+                        record = _loads(line)
+                        session_id = record["id"]
+                    except (ValueError, KeyError, TypeError):
+                        return ChatHistory._rebuild_index()
+                    if record.get("deleted"):
+                        entries.pop(session_id, None)
+                    else:
+                        entries.setdefault(session_id, {}).update(record)
+            
+            if records > 2 * len(entries) + 32:
+                try:
+                    ChatHistory._write_index(entries)
+                except OSError:
+                    pass
+            return entries
+    
+    @staticmethod
+    def list_sessions() -> list[tuple[Path, dict]]:
         if not HISTORY_DIR.exists():
             return []
         
-        sessions = sorted(HISTORY_DIR.glob("chat_*.json"), reverse=True)
+        try:
+            entries = ChatHistory._read_index()
+        except Exception as e:
+            print(f"Error loading history index: {e}")
+            return []
+        
+        sessions = []
+        for _, entry in sorted(entries.items(), reverse=True):
+            if entry.get("file"):
+                sessions.append((HISTORY_DIR / entry["file"], entry))
         return sessions
     
+    @staticmethod
+    def current_metadata(session_path: Path, entry: dict) -> dict:
+        open_history = ChatHistory._open_sessions.get(session_path)
+        if open_history is not None:
+            return {**entry, **open_history.metadata}
+        if entry.get("closed") or session_path.suffix != ".jsonl":
+            return entry
+        
+        # The session was never closed (e.g. the terminal was killed), so its
+        # recorded count may be stale. Recount once and record the result.
+        try:
+            count = sum(1 for _ in ChatHistory.iter_messages(session_path))
+        except Exception:
+            return entry
+        ChatHistory._append_index({"id": entry["id"], "message_count": count, "closed": True})
+        return {**entry, "message_count": count, "closed": True}
+    
     @staticmethod
     def load_session(session_path: Path) -> dict | None:
         try:
-            with open(session_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            if session_path.suffix == ".json":
+                with open(session_path, 'rb') as f:
+                    return _loads(f.read())
+            
+            messages = list(ChatHistory.iter_messages(session_path))
+            
+            metadata = {}
+            meta_path = ChatHistory._meta_path(session_path)
+            if meta_path.exists():
+                with open(meta_path, 'rb') as f:
+                    metadata = _loads(f.read())
+            metadata["message_count"] = len(messages)
+            
+            return {"metadata": metadata, "messages": messages}
+        except Exception as e:
+            print(f"Error loading session: {e}")
+            return None
+    
+    @staticmethod
+    def iter_messages(session_path: Path) -> Iterator[dict]:
+        with open(session_path, 'rb') as f:
+            if session_path.suffix == ".json":
+                if ijson is not None:
+                    yield from ijson.items(f, 'messages.item', use_float=True)
+                else:
+                    yield from _loads(f.read()).get("messages", [])
+                return
+            
+            if session_path.suffix == ".zst":
+                if zstd is None:
+                    raise RuntimeError("the zstandard package is required to read archived sessions")
+                f = io.BufferedReader(zstd.ZstdDecompressor().stream_reader(f))
+            
+            # A crash mid-write can leave a truncated last line; stop before it.
+            decode_error = None
+            for line in f:
+                if not line.strip():
+                    continue
+                if decode_error is not None:
+                    raise decode_error
+                try:
+                    message = _loads(line)
+                except ValueError as e:
+                    decode_error = e
+                    continue
+                yield message
+    
+    @staticmethod
+    def compact_old_sessions():
+        if zstd is None:
+            return
+        
+        cutoff = (datetime.now() - SESSION_ARCHIVE_AGE).timestamp()
+        for path in HISTORY_DIR.glob("chat_*.jsonl"):
+            try:
+                if path.stat().st_mtime > cutoff:
+                    continue
+                
+                archive_path = path.with_name(path.name + ".zst")
+                tmp = archive_path.with_name(archive_path.name + ".tmp")
+                with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+                    zstd.ZstdCompressor(level=3).copy_stream(src, dst)
+                
+                with _INDEX_LOCK:
+                    os.replace(tmp, archive_path)
+                    ChatHistory._write_index_record({"id": ChatHistory._session_id(path), "file": archive_path.name})
+                    path.unlink()
+            except Exception:
+                # Runs on a background thread during prompts; a session that
+                # fails to archive simply stays uncompressed.
+                continue
+    
+    @staticmethod
+    def load_metadata(session_path: Path) -> dict | None:
+        meta_path = ChatHistory._meta_path(session_path)
+        try:
+            if meta_path.exists():
+                with open(meta_path, 'rb') as f:
+                    return _loads(f.read())
+            
+            if session_path.suffix == ".json":
+                with open(session_path, 'rb') as f:
+                    head = f.read(2048)
+                end = head.find(b'"messages"')
+                if end != -1:
+                    try:
+                        head_data = _loads(head[:end].rstrip().rstrip(b",") + b"}")
+                    except ValueError:
+                        head_data = {}
+                    if "metadata" in head_data:
+                        return head_data["metadata"]
         except Exception as e:
             print(f"Error loading session: {e}")
             return None
+        
+        data = ChatHistory.load_session(session_path)
+        return data.get("metadata", {}) if data else None
     
     @staticmethod
     def delete_session(session_path: Path) -> bool:
+        if session_path in ChatHistory._open_sessions:
+            print("Cannot delete the current session while it is open")
+            return False
         try:
-            session_path.unlink()
+            session_path.unlink(missing_ok=True)
+            ChatHistory._meta_path(session_path).unlink(missing_ok=True)
+            ChatHistory._append_index({"id": ChatHistory._session_id(session_path), "deleted": True})
             return True
         except Exception as e:
             print(f"Error deleting session: {e}")
@@ -152,21 +495,22 @@ def view_history():
     print_header("CHAT HISTORY")
     
     sessions = ChatHistory.list_sessions()
+    # Only stat the sessions that are actually shown; stale index entries are skipped here.
+    shown = list(islice(((p, e) for p, e in sessions if p.exists()), 10))
     
-    if not sessions:
+    if not shown:
         print("No saved conversations found.")
         return
     
-    print(f"Found {len(sessions)} conversation(s):\n")
+    total = len(shown) if len(shown) < 10 else len(sessions)
+    print(f"Found {total} conversation(s):\n")
     
-    for i, session_path in enumerate(sessions[:10], 1):
-        data = ChatHistory.load_session(session_path)
-        if data:
-            meta = data.get("metadata", {})
-            created = meta.get("created", "Unknown")[:16].replace("T", " ")
-            model = meta.get("model", "Unknown")
-            count = meta.get("message_count", 0)
-            print(f"  {i}. [{created}] {model} ({count} messages)")
+    for i, (session_path, entry) in enumerate(shown, 1):
+        meta = ChatHistory.current_metadata(session_path, entry)
+        created = meta.get("created", "Unknown")[:16].replace("T", " ")
+        model = meta.get("model", "Unknown")
+        count = meta.get("message_count", 0)
+        print(f"  {i}. [{created}] {model} ({count} messages)")
     
     print(f"\n  0. Back to chat")
     print(f"  d. Delete a session")
@@ -181,10 +525,10 @@ def view_history():
         delete_idx = input("Enter session number to delete: ").strip()
         try:
             idx = int(delete_idx) - 1
-            if 0 <= idx < len(sessions):
+            if 0 <= idx < len(shown):
                 confirm = input(f"Delete session {delete_idx}? [y/N]: ").strip().lower()
                 if confirm == 'y':
-                    if ChatHistory.delete_session(sessions[idx]):
+                    if ChatHistory.delete_session(shown[idx][0]):
                         print("[OK] Session deleted")
                     else:
                         print("[ERROR] Failed to delete")
@@ -195,43 +539,61 @@ def view_history():
     if choice == 'c':
         confirm = input("Delete ALL chat history? [y/N]: ").strip().lower()
         if confirm == 'y':
-            for session in sessions:
-                ChatHistory.delete_session(session)
-            print("[OK] All history cleared")
+            deleted = sum(ChatHistory.delete_session(session_path) for session_path, _ in sessions)
+            clear_repl_history()
+            print(f"[OK] Cleared {deleted} of {len(sessions)} conversation(s)")
         return
     
     try:
         idx = int(choice) - 1
-        if 0 <= idx < len(sessions):
-            display_session(sessions[idx])
+        if 0 <= idx < len(shown):
+            display_session(shown[idx][0])
     except ValueError:
         print("Invalid selection")
 
 
 def display_session(session_path: Path):
-    data = ChatHistory.load_session(session_path)
-    if not data:
+    meta = ChatHistory.load_metadata(session_path)
+    if meta is None:
         return
     
-    clear_screen()
-    meta = data.get("metadata", {})
-    messages = data.get("messages", [])
+    try:
+        messages = list(islice(ChatHistory.iter_messages(session_path), DISPLAY_LIMIT + 1))
+    except Exception as e:
+        print(f"Error loading session: {e}")
+        return
+    
+    truncated = len(messages) > DISPLAY_LIMIT
+    messages = messages[:DISPLAY_LIMIT]
     
+    clear_screen()
     print_header(f"CONVERSATION - {meta.get('created', '')[:10]}")
     print(f"Model: {meta.get('model', 'Unknown')}")
-    print(f"Messages: {len(messages)}")
+    if truncated:
+        total = meta.get("message_count", 0)
+        total_text = str(total) if total > DISPLAY_LIMIT else f"more than {DISPLAY_LIMIT}"
+        print(f"Messages: {total_text} (showing the first {DISPLAY_LIMIT})")
+    else:
+        print(f"Messages: {len(messages)}")
     print("-" * 40)
     
-    for msg in messages:
+    timestamps = [msg.get("timestamp", "")[:19].replace("T", " ") for msg in messages]
+    parts: list[str] = []
+    
+    for msg, timestamp in zip(messages, timestamps):
         role = msg.get("role", "unknown").upper()
         content = msg.get("content", "")
-        timestamp = msg.get("timestamp", "")[:19].replace("T", " ")
         has_file = "[file] " if msg.get("has_attachment") else ""
+        ellipsis = "..." if len(content) > 500 else ""
         
-        print(f"\n[{timestamp}] {role}:")
-        print(f"{has_file}{content[:500]}{'...' if len(content) > 500 else ''}")
+        parts.append(f"\n[{timestamp}] {role}:\n{has_file}{content[:500]}{ellipsis}\n")
+    
+    if truncated:
+        parts.append(f"\n[... showing the first {DISPLAY_LIMIT} messages, later messages truncated ...]\n")
     
-    print("\n" + "-" * 40)
+    parts.append("\n" + "-" * 40 + "\n")
+    sys.stdout.write("".join(parts))
+    sys.stdout.flush()
     input("Press Enter to continue...")
 
 
@@ -239,21 +601,28 @@ def export_history(history: ChatHistory):
     export_path = DATA_DIR / f"export_{history.session_id}.txt"
     
     try:
-        with open(export_path, 'w', encoding='utf-8') as f:
-            f.write(f"{APP_NAME} - Chat Export\n")
-            f.write(f"{'='*40}\n\n")
-            f.write(f"Session: {history.session_id}\n")
-            f.write(f"Model: {history.metadata.get('model', 'Unknown')}\n")
-            f.write(f"Created: {history.metadata.get('created', '')}\n")
-            f.write(f"\n{'-'*40}\n\n")
+        parts = [
+            f"{APP_NAME} - Chat Export\n",
+            f"{'='*40}\n\n",
+            f"Session: {history.session_id}\n",
+            f"Model: {history.metadata.get('model', 'Unknown')}\n",
+            f"Created: {history.metadata.get('created', '')}\n",
+            f"\n{'-'*40}\n\n",
+        ]
+        
+        for msg in history.messages:
+            role = msg.get("role", "unknown").upper()
+            content = msg.get("content", "")
+            timestamp = msg.get("timestamp", "")[:19].replace("T", " ")
             
-            for msg in history.messages:
-                role = msg.get("role", "unknown").upper()
-                content = msg.get("content", "")
-                timestamp = msg.get("timestamp", "")[:19].replace("T", " ")
-                
-                f.write(f"[{timestamp}] {role}:\n")
-                f.write(f"{content}\n\n")
+            parts.append(f"[{timestamp}] {role}:\n")
+            parts.append(f"{content}\n\n")
+        
+        data = "".join(parts).encode('utf-8')
+        if zstd is not None:
+            export_path = export_path.with_name(export_path.name + ".zst")
+            data = zstd.ZstdCompressor(level=3).compress(data)
+        export_path.write_bytes(data)
         
         print(f"[OK] Exported to: {export_path}")
     
@@ -262,19 +631,15 @@ def export_history(history: ChatHistory):
 
 
 def load_config() -> dict:
-    if CONFIG_FILE.exists():
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    return {}
+    try:
+        return _loads(CONFIG_FILE.read_bytes())
+    except Exception:
+        return {}
 
 
 def save_config(config: dict):
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        _atomic_write(CONFIG_FILE, _dumps(config))
     except Exception as e:
         print(f"Warning: Could not save config: {e}")
 
@@ -333,24 +698,19 @@ def select_model() -> str:
 
 
 def get_mime_type(file_path: Path) -> str:
-    mime_types = {
-        '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
-        '.png': 'image/png', '.gif': 'image/gif', '.webp': 'image/webp',
-        '.mp4': 'video/mp4', '.mpeg': 'video/mpeg',
-        '.mov': 'video/quicktime', '.avi': 'video/x-msvideo', '.webm': 'video/webm',
-        '.mp3': 'audio/mp3', '.wav': 'audio/wav',
-        '.aiff': 'audio/aiff', '.aac': 'audio/aac',
-        '.ogg': 'audio/ogg', '.flac': 'audio/flac',
-    }
-    return mime_types.get(file_path.suffix.lower(), 'application/octet-stream')
+    return (
+        MIME_TYPES.get(file_path.suffix.lower())
+        or mimetypes.guess_type(file_path.name)[0]
+        or 'application/octet-stream'
+    )
 
 
 def select_file() -> tuple[Path, str] | None:
     print_header("FILE SELECTOR")
     print("Supported formats:")
     print("  Images: jpg, jpeg, png, gif, webp")
-    print("  Videos: mp4, mpeg, mov, avi, webm")
-    print("  Audio:  mp3, wav, aiff, aac, ogg, flac")
+    print("  Videos: mp4, mpeg, mov, avi, webm, mkv")
+    print("  Audio:  mp3, wav, aiff, aac, ogg, flac, m4a, opus")
     
     file_path = input("\nEnter file path (or drag and drop): ").strip().strip("'\"")
     
@@ -380,26 +740,138 @@ def select_file() -> tuple[Path, str] | None:
 
 
 def upload_file(client: genai.Client, file_path: Path, mime_type: str):
-    print(f"Uploading {file_path.name}...", end=" ", flush=True)
-    
-    uploaded_file = client.files.upload(
+    return client.files.upload(
         file=file_path,
         config={"mime_type": mime_type}
     )
+
+
+class BackgroundUpload:
+    def __init__(self, client: genai.Client, file_path: Path, mime_type: str):
+        self._result = None
+        self._error: Exception | None = None
+        self._done = threading.Event()
+        # A daemon thread, so /quit does not have to wait for a large upload to finish.
+        self._thread = threading.Thread(target=self._run, args=(client, file_path, mime_type), daemon=True)
+        self._thread.start()
     
-    print("[OK]")
-    return uploaded_file
+    def _run(self, client: genai.Client, file_path: Path, mime_type: str):
+        try:
+            self._result = upload_file(client, file_path, mime_type)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+    
+    def done(self) -> bool:
+        return self._done.is_set()
+    
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def build_generate_config():
+    from google.genai import types
+    
+    return types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT)
 
 
 def print_help():
-    print("\nCommands:")
-    print("  /file    - Attach a file")
-    print("  /history - View saved conversations")
-    print("  /export  - Export current chat")
-    print("  /model   - Change AI model")
-    print("  /clear   - Clear screen")
-    print("  /help    - Show this help")
-    print("  /quit    - Exit OTP")
+    sys.stdout.write(
+        "\nCommands:\n"
+        "  /file    - Attach a file\n"
+        "  /history - View saved conversations\n"
+        "  /export  - Export current chat\n"
+        "  /model   - Change AI model\n"
+        "  /clear   - Clear screen\n"
+        "  /help    - Show this help\n"
+        "  /quit    - Exit OTP\n"
+    )
+    sys.stdout.flush()
+
+
+@dataclass
+class ChatContext:
+    client: genai.Client
+    model: str
+    history: ChatHistory
+    gen_config: Any = field(default_factory=build_generate_config)
+    attached_file: Any = None
+    attached_file_upload: BackgroundUpload | None = None
+    attached_file_name: str | None = None
+    
+    def use_model(self, model: str):
+        self.model = model
+        self.history.set_model(model)
+
+
+def _handle_quit(ctx: ChatContext) -> bool:
+    if ctx.attached_file_upload and not ctx.attached_file_upload.done():
+        print(f"\n[attachment discarded: upload of {ctx.attached_file_name} abandoned]")
+    ctx.history.close()
+    print(f"\n[OK] Chat saved to: {ctx.history.get_session_path()}")
+    print("Goodbye!")
+    return True
+
+
+def _handle_clear(ctx: ChatContext):
+    clear_screen()
+    print(f"{APP_NAME}")
+    print(f"Model: {ctx.model} | Session: {ctx.history.session_id}")
+
+
+def _handle_help(ctx: ChatContext):
+    print_help()
+
+
+def _handle_model(ctx: ChatContext):
+    ctx.use_model(select_model())
+    print(f"\n[OK] Now using: {ctx.model}")
+
+
+def _handle_history(ctx: ChatContext):
+    view_history()
+
+
+def _handle_export(ctx: ChatContext):
+    ctx.history.flush()
+    export_history(ctx.history)
+
+
+def _handle_file(ctx: ChatContext):
+    result = select_file()
+    if not result:
+        return
+    
+    file_path, mime_type = result
+    if ctx.attached_file_upload:
+        if not ctx.attached_file_upload.done():
+            print(f"[previous upload of {ctx.attached_file_name} is still running and will be ignored]")
+        ctx.attached_file_upload = None
+    
+    if file_path.stat().st_size < BACKGROUND_UPLOAD_MIN_SIZE:
+        print(f"Uploading {file_path.name}...", end=" ", flush=True)
+        ctx.attached_file = upload_file(ctx.client, file_path, mime_type)
+        print("[OK]")
+    else:
+        print(f"Uploading {file_path.name} in the background...")
+        ctx.attached_file = None
+        ctx.attached_file_upload = BackgroundUpload(ctx.client, file_path, mime_type)
+    ctx.attached_file_name = file_path.name
+
+
+COMMAND_HANDLERS: dict[str, Callable[[ChatContext], bool | None]] = {
+    '/file': _handle_file,
+    '/history': _handle_history,
+    '/export': _handle_export,
+    '/model': _handle_model,
+    '/clear': _handle_clear,
+    '/help': _handle_help,
+    '/quit': _handle_quit,
+}
 
 
 def chat_loop(client: genai.Client, model: str):
@@ -411,93 +883,79 @@ def chat_loop(client: genai.Client, model: str):
     print("Type /help for commands")
     print("=" * 40)
     
-    history = ChatHistory()
-    history.set_model(model)
-    
-    attached_file = None
-    attached_file_name = None
+    ctx = ChatContext(client=client, model=model, history=ChatHistory())
+    ctx.history.set_model(model)
+    history = ctx.history
     
     while True:
         try:
-            attachment_indicator = f" [attached: {attached_file_name}]" if attached_file else ""
+            attachment_indicator = f" [attached: {ctx.attached_file_name}]" if ctx.attached_file_name else ""
             
             user_input = input(f"\nYou{attachment_indicator}: ").strip()
             
             if not user_input:
                 continue
+            add_repl_history(user_input)
             
-            cmd = user_input.lower()
-            
-            if cmd == '/quit':
-                print(f"\n[OK] Chat saved to: {history.get_session_path()}")
-                print("Goodbye!")
-                break
-            
-            if cmd == '/clear':
-                clear_screen()
-                print(f"{APP_NAME}")
-                print(f"Model: {model} | Session: {history.session_id}")
+            handler = COMMAND_HANDLERS.get(user_input.lower())
+            if handler:
+                if handler(ctx):
+                    break
                 continue
             
-            if cmd == '/help':
-                print_help()
-                continue
-            
-            if cmd == '/model':
-                model = select_model()
-                history.set_model(model)
-                print(f"\n[OK] Now using: {model}")
-                continue
-            
-            if cmd == '/history':
-                view_history()
-                continue
-            
-            if cmd == '/export':
-                export_history(history)
-                continue
-            
-            if cmd == '/file':
-                result = select_file()
-                if result:
-                    file_path, mime_type = result
-                    attached_file = upload_file(client, file_path, mime_type)
-                    attached_file_name = file_path.name
-                continue
+            if ctx.attached_file_upload:
+                if not ctx.attached_file_upload.done():
+                    print(f"Waiting for {ctx.attached_file_name} to finish uploading...")
+                try:
+                    ctx.attached_file = ctx.attached_file_upload.result()
+                except Exception as e:
+                    ctx.attached_file_upload = None
+                    ctx.attached_file_name = None
+                    print(f"[ERROR] Upload failed, message not sent: {e}")
+                    continue
+                ctx.attached_file_upload = None
             
             contents = []
-            if attached_file:
-                contents.append(attached_file)
+            if ctx.attached_file:
+                contents.append(ctx.attached_file)
             contents.append(user_input)
             
-            history.add_message("user", user_input, has_file=bool(attached_file))
+            history.add_message("user", user_input, has_file=bool(ctx.attached_file))
             
             print("\nOTP: ", end="", flush=True)
             
-            response = client.models.generate_content(
-                model=model,
+            stream = client.models.generate_content_stream(
+                model=ctx.model,
                 contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=SYSTEM_PROMPT,
-                )
+                config=ctx.gen_config
             )
             
-            response_text = response.text
-            print(response_text)
+            chunks = []
+            for chunk in stream:
+                text = chunk.text or ""
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                chunks.append(text)
+            print()
+            
+            response_text = "".join(chunks)
             
             history.add_message("assistant", response_text)
+            history.flush()
             
-            if attached_file:
-                attached_file = None
-                attached_file_name = None
+            if ctx.attached_file:
+                ctx.attached_file = None
+                ctx.attached_file_name = None
                 print("\n[attachment cleared]")
         
         except KeyboardInterrupt:
+            history.flush()
             print("\n\nUse /quit to exit (saves chat history)")
         
         except Exception as e:
             print(f"\n[ERROR] {e}")
             history.add_message("system", f"Error: {e}")
+            history.flush()
 
 
 def main():
@@ -510,10 +968,29 @@ def main():
     print(f"History: {HISTORY_DIR}")
     
     api_key = get_api_key()
+    setup_readline()
     model = select_model()
     
     print("\nConnecting...", end=" ", flush=True)
-    client = genai.Client(api_key=api_key)
+    
+    try:
+        import httpx
+        from google import genai
+        from google.genai import types
+    except ImportError:
+        print("\nPlease install the google-genai package:")
+        print("  pip install -U google-genai")
+        sys.exit(1)
+    
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            client_args={
+                "http2": importlib.util.find_spec("h2") is not None,
+                "limits": httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300),
+            }
+        )
+    )
     print("[OK]")
     
     chat_loop(client, model)